@@ -2,8 +2,12 @@ import os
 import asyncio
 import shutil
 import logging
+import logging.handlers
+import queue
+from operator import itemgetter
 from typing import List
-import aiofiles
+import aiohttp
+from azure.core.pipeline.transport import AioHttpTransport
 from azure.identity.aio import DefaultAzureCredential
 from azure.storage.filedatalake.aio import (
     DataLakeServiceClient,
@@ -21,7 +25,10 @@ REMOTE_ROOT_PATH         = os.getenv("REMOTE_ROOT_PATH", "remote/target/folder")
 MAX_CONCURRENT_UPLOADS   = int(os.getenv("MAX_CONCURRENT_UPLOADS", "10"))
 DELETE_LOCAL_AFTER_UPLOAD = os.getenv("DELETE_LOCAL_AFTER_UPLOAD", "true").lower() == "true"
 RETRY_COUNT              = int(os.getenv("RETRY_COUNT", "3"))
+UPLOAD_CHUNK_SIZE        = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+MAX_CONCURRENT_CHUNKS    = int(os.getenv("MAX_CONCURRENT_CHUNKS", "4"))
 LOG_FILE_PATH            = os.getenv("LOG_FILE_PATH", "upload_to_adls.log")
+STORAGE_TOKEN_SCOPE      = "https://storage.azure.com/.default"
 
 # === LOGGING SETUP ===
 logger = logging.getLogger("adls_upload")
@@ -33,11 +40,14 @@ formatter = logging.Formatter(
 # Console handler
 ch = logging.StreamHandler()
 ch.setFormatter(formatter)
-logger.addHandler(ch)
 # File handler with UTF-8 encoding to avoid charmap errors
 fh = logging.FileHandler(LOG_FILE_PATH, encoding="utf-8")
 fh.setFormatter(formatter)
-logger.addHandler(fh)
+# Log calls on the event loop only enqueue records; a background listener
+# thread does the formatting and the blocking console/file writes
+log_queue: queue.Queue = queue.Queue(-1)
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, ch, fh, respect_handler_level=True)
 
 # Optionally enable deeper logging for Azure SDK, if debugging
 azure_logger = logging.getLogger("azure")
@@ -56,7 +66,11 @@ async def _create_remote_directory(fs_client: FileSystemClient, remote_dir: str)
         # Check for “already exists” error code (varies by version)
         logger.warning(f"Unable to create remote directory {remote_dir}: {ex}")
 
-async def _upload_file(fs_client: FileSystemClient, local_path: str, remote_path: str):
+def _read_file_bytes(local_path: str) -> bytes:
+    with open(local_path, 'rb') as f:
+        return f.read()
+
+async def _upload_file(fs_client: FileSystemClient, local_path: str, remote_path: str, file_size: int):
     """
     Upload a single file to ADLS Gen2 with retry logic and optional local deletion.
     """
@@ -65,16 +79,30 @@ async def _upload_file(fs_client: FileSystemClient, local_path: str, remote_path
         attempt += 1
         try:
             file_client: DataLakeFileClient = fs_client.get_file_client(remote_path)
-            await file_client.create_file()
-            # Read file contents asynchronously
-            async with aiofiles.open(local_path, mode='rb') as f:
-                data = await f.read()
-            await file_client.append_data(data=data, offset=0, length=len(data))
-            await file_client.flush_data(offset=len(data))
+            # upload_data creates the file and stages large files as parallel chunks.
+            # TLS already protects the wire, so skip per-chunk MD5 validation.
+            if file_size <= UPLOAD_CHUNK_SIZE:
+                # Small files: one plain read in the default executor is cheaper than aiofiles
+                loop = asyncio.get_running_loop()
+                data = await loop.run_in_executor(None, _read_file_bytes, local_path)
+                await file_client.upload_data(
+                    data=data, length=len(data), overwrite=True, validate_content=False
+                )
+            else:
+                with open(local_path, 'rb') as fh:
+                    await file_client.upload_data(
+                        data=fh,
+                        length=file_size,
+                        overwrite=True,
+                        validate_content=False,
+                        max_concurrency=MAX_CONCURRENT_CHUNKS,
+                        chunk_size=UPLOAD_CHUNK_SIZE,
+                    )
             logger.info(f"Uploaded file: {local_path} → {remote_path}")
             if DELETE_LOCAL_AFTER_UPLOAD:
                 try:
-                    os.remove(local_path)
+                    # Unlink off the loop thread; files of failed uploads stay for a re-run
+                    await asyncio.get_running_loop().run_in_executor(None, os.unlink, local_path)
                     logger.info(f"Deleted local file: {local_path}")
                 except Exception as del_ex:
                     logger.warning(f"Failed to delete local file {local_path}: {del_ex}")
@@ -90,43 +118,86 @@ async def _upload_file(fs_client: FileSystemClient, local_path: str, remote_path
             logger.error(f"Unexpected error uploading file {local_path}: {ex}")
             raise
 
+def _walk(local_dir: str, remote_prefix: str):
+    """
+    Recursively yield (local_path, remote_path, size) tuples under local_dir,
+    carrying the POSIX-style remote prefix (no leading or trailing slash, empty for
+    the filesystem root) down the recursion. Only empty directories are yielded
+    (with a local_path of None and a size of 0); ADLS creates parent directories
+    implicitly when files are uploaded into them.
+    """
+    is_empty = True
+    subdirs = []
+    with os.scandir(local_dir) as entries:
+        for entry in entries:
+            is_empty = False
+            remote_path = f"{remote_prefix}/{entry.name}" if remote_prefix else entry.name
+            if entry.is_dir():
+                # Like os.walk, don't descend into symlinked directories
+                if not entry.is_symlink():
+                    subdirs.append((entry.path, remote_path))
+            else:
+                try:
+                    size = entry.stat().st_size
+                except OSError:
+                    # e.g. a dangling symlink; let its upload attempt report the error
+                    size = 0
+                yield entry.path, remote_path, size
+    # An empty prefix is the filesystem root, which always exists
+    if is_empty and remote_prefix:
+        yield None, remote_prefix, 0
+    for sub_local, sub_remote in subdirs:
+        yield from _walk(sub_local, sub_remote)
+
+def _largest_first(local_folder: str, remote_root: str) -> list:
+    """Walk local_folder and order the entries by size, largest first."""
+    return sorted(_walk(local_folder, remote_root), key=itemgetter(2), reverse=True)
+
+async def _upload_worker(fs_client: FileSystemClient, work_queue: asyncio.Queue, failures: List[Exception]):
+    """
+    Drain work_queue until a None sentinel arrives, creating each empty directory
+    or uploading each file and collecting failures instead of raising them.
+    """
+    while True:
+        item = await work_queue.get()
+        if item is None:
+            return
+        local_path, remote_path, size = item
+        try:
+            if local_path is None:
+                await _create_remote_directory(fs_client, remote_path)
+            else:
+                await _upload_file(fs_client, local_path, remote_path, size)
+        except Exception as ex:
+            failures.append(ex)
+
 async def _upload_folder(fs_client: FileSystemClient, local_folder: str, remote_root: str):
     """
-    Walk through local_folder, create remote directories (including empty ones),
-    then upload files, all in parallel with concurrency control.
+    Walk through local_folder in a background thread, then let MAX_CONCURRENT_UPLOADS
+    workers drain a queue to upload files and create the remote directories that no
+    file upload would create (empty ones). Files are scheduled largest first so a big
+    file picked up last can't stretch the run while the other workers sit idle.
     """
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
-    tasks: List[asyncio.Task] = []
-    dir_count = 0
-    file_count = 0
-
-    for root, dirs, files in os.walk(local_folder):
-        # Compute the relative directory path and remote path
-        rel_dir = os.path.relpath(root, local_folder)
-        if rel_dir == ".":
-            rel_dir = ""
-        remote_dir = os.path.join(remote_root, rel_dir).replace("\\", "/")
-        # Schedule directory creation
-        dir_count += 1
-        tasks.append(asyncio.create_task(_create_remote_directory(fs_client, remote_dir)))
-
-        # Schedule file uploads
-        for fname in files:
-            file_count += 1
-            local_path = os.path.join(root, fname)
-            rel_file_path = os.path.join(rel_dir, fname) if rel_dir else fname
-            remote_path = os.path.join(remote_root, rel_file_path).replace("\\", "/")
-
-            async def sem_upload(lp=local_path, rp=remote_path):
-                async with semaphore:
-                    await _upload_file(fs_client, lp, rp)
-
-            tasks.append(asyncio.create_task(sem_upload()))
-
-    logger.info(f"Scheduled {dir_count} directories and {file_count} files for upload.")
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-
-    failures = [r for r in results if isinstance(r, Exception)]
+    loop = asyncio.get_running_loop()
+    entries = await loop.run_in_executor(
+        None, _largest_first, local_folder, remote_root.replace("\\", "/").strip("/")
+    )
+    file_count = sum(1 for local_path, _, _ in entries if local_path is not None)
+    dir_count = len(entries) - file_count
+
+    work_queue: asyncio.Queue = asyncio.Queue()
+    for entry in entries:
+        work_queue.put_nowait(entry)
+    # One sentinel per worker after the real work
+    for _ in range(MAX_CONCURRENT_UPLOADS):
+        work_queue.put_nowait(None)
+    failures: List[Exception] = []
+
+    logger.info(f"Scheduled {dir_count} empty directories and {file_count} files for upload.")
+    await asyncio.gather(*(
+        _upload_worker(fs_client, work_queue, failures) for _ in range(MAX_CONCURRENT_UPLOADS)
+    ))
+
     if failures:
         logger.error(f"{len(failures)} failure(s) occurred out of total scheduled tasks.")
     else:
@@ -142,25 +213,50 @@ async def _upload_folder(fs_client: FileSystemClient, local_folder: str, remote_
 async def main():
     account_url = f"https://{STORAGE_ACCOUNT_NAME}.dfs.core.windows.net"
     credential = DefaultAzureCredential()
-    async with DataLakeServiceClient(account_url=account_url, credential=credential) as service_client:
-        logger.info(f"Connected to ADLS account: {STORAGE_ACCOUNT_NAME}")
-        fs_client = service_client.get_file_system_client(FILE_SYSTEM_NAME)
-        # Ensure filesystem exists (or create it)
-        try:
-            await service_client.create_file_system(FILE_SYSTEM_NAME)
-            logger.info(f"Created filesystem: {FILE_SYSTEM_NAME}")
-        except AzureError as ex:
-            logger.info(f"Filesystem {FILE_SYSTEM_NAME} might already exist: {ex}")
-
-        logger.info(f"Beginning upload from {LOCAL_FOLDER} → {FILE_SYSTEM_NAME}/{REMOTE_ROOT_PATH}")
-        await _upload_folder(fs_client, LOCAL_FOLDER, REMOTE_ROOT_PATH)
+    try:
+        # Prime the shared credential's token cache once, before workers start
+        # issuing requests concurrently; this also surfaces auth problems early.
+        await credential.get_token(STORAGE_TOKEN_SCOPE)
+        logger.info("Acquired storage access token")
+        # Size the connection pool to the upload concurrency (each upload may run
+        # MAX_CONCURRENT_CHUNKS requests) and keep connections alive between files
+        connector = aiohttp.TCPConnector(
+            limit=MAX_CONCURRENT_UPLOADS * MAX_CONCURRENT_CHUNKS,
+            limit_per_host=MAX_CONCURRENT_UPLOADS * MAX_CONCURRENT_CHUNKS,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        # The transport doesn't own the session, so close it here even if the upload fails
+        async with aiohttp.ClientSession(connector=connector) as session:
+            transport = AioHttpTransport(session=session, session_owner=False)
+            async with DataLakeServiceClient(account_url=account_url, credential=credential, transport=transport) as service_client:
+                logger.info(f"Connected to ADLS account: {STORAGE_ACCOUNT_NAME}")
+                fs_client = service_client.get_file_system_client(FILE_SYSTEM_NAME)
+                # Ensure filesystem exists (or create it)
+                try:
+                    await service_client.create_file_system(FILE_SYSTEM_NAME)
+                    logger.info(f"Created filesystem: {FILE_SYSTEM_NAME}")
+                except AzureError as ex:
+                    logger.info(f"Filesystem {FILE_SYSTEM_NAME} might already exist: {ex}")
 
-    await credential.close()
+                logger.info(f"Beginning upload from {LOCAL_FOLDER} → {FILE_SYSTEM_NAME}/{REMOTE_ROOT_PATH}")
+                await _upload_folder(fs_client, LOCAL_FOLDER, REMOTE_ROOT_PATH)
+    finally:
+        await credential.close()
     logger.info("Upload process completed.")
 
 if __name__ == "__main__":
+    # Use uvloop's faster event loop when it's installed
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    log_listener.start()
     try:
         asyncio.run(main())
     except Exception as ex:
         logger.exception(f"Fatal error during upload: {ex}")
         exit(1)
+    finally:
+        log_listener.stop()
@@ -1,12 +1,21 @@
 import asyncio
-import json
+import functools
+import logging
 import os
+import random
 import time
-from typing import List, Dict, Any
-import copy
+from typing import List, Dict, Any, Callable
+from collections import deque
 
-# Make sure to pip install "openai>=1.0.0"
-from openai import AsyncAzureOpenAI
+# Make sure to pip install "openai>=1.0.0" orjson "httpx[http2]" tiktoken
+import httpx
+import orjson
+import tiktoken
+from openai import AsyncAzureOpenAI, RateLimitError
+
+# Per-batch progress goes to DEBUG; set level=logging.DEBUG to follow every request
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 
@@ -20,14 +29,23 @@ AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 if not all([AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_KEY, AZURE_OPENAI_DEPLOYMENT_NAME, AZURE_OPENAI_API_VERSION]):
     raise ValueError("One or more required Azure OpenAI environment variables are not set.")
 
-# NEW: Control how many columns are sent in a single prompt.
-SCHEMA_CHUNK_SIZE = 10 
+# Control how much schema is sent in a single prompt: columns are packed into as few
+# chunks as possible while each chunk's serialized schema stays under this token budget.
+MAX_SCHEMA_PROMPT_TOKENS = 4000
+TOKENIZER_ENCODING = "o200k_base"  # tiktoken encoding of the deployed model
+MODEL_CONTEXT_TOKENS = 128000  # Context window (prompt + completion) of the deployed model
+EST_OUTPUT_TOKENS_PER_FIELD = 16  # Rough completion cost of one generated value, JSON syntax included
 
 # Parameters for data generation
 TOTAL_RECORDS_TO_GENERATE = 100
-RECORDS_PER_API_CALL = 10
+RECORDS_PER_API_CALL = 10  # Starting batch size; adapted at runtime between the bounds below
+MIN_RECORDS_PER_API_CALL = 5
+MAX_RECORDS_PER_API_CALL = 50
+TARGET_BATCH_LATENCY = 8.0  # Seconds per API call the batch size is steered towards
+BATCH_ADAPTATION_RATE = 0.2
 MAX_CONCURRENT_REQUESTS = 5
 MAX_RETRIES_PER_BATCH = 3
+OUTPUT_FILE = "generated_data_azure.jsonl"  # One JSON record per line, appended as records complete
 
 # Your input schema (can be much larger)
 HUGE_SCHEMA = [
@@ -41,149 +59,349 @@ HUGE_SCHEMA = [
     {"name": "EngineType", "data_type": "Text", "parameters": "Type of engine, e.g., 'V6', '4-Cylinder', 'Electric'", "sample_data": "V6"},
     {"name": "Transmission", "data_type": "Text", "parameters": "'Automatic' or 'Manual'", "sample_data": "Automatic"},
     {"name": "OwnerCount", "data_type": "Number", "parameters": "Number of previous owners, from 1 to 5", "sample_data": 2},
-    # --- Chunk boundary would be here if SCHEMA_CHUNK_SIZE = 10 ---
     {"name": "AccidentHistory", "data_type": "Boolean", "parameters": "True if the vehicle has been in an accident", "sample_data": False},
     {"name": "FuelType", "data_type": "Text", "parameters": "'Gasoline', 'Diesel', 'Electric', 'Hybrid'", "sample_data": "Gasoline"},
 ]
 
+# Merged records are kept as slot lists in schema order, indexed through this table
+COLUMN_NAMES = [item['name'] for item in HUGE_SCHEMA]
+COLUMN_INDEX = {name: i for i, name in enumerate(COLUMN_NAMES)}
+MISSING = object()  # Marks a slot whose chunk hasn't delivered the column yet
+
+# Maps schema data types to JSON Schema types for structured outputs
+JSON_SCHEMA_TYPES = {"Text": "string", "Number": "number", "Boolean": "boolean"}
+
 # --- Core Logic ---
 
-def chunk_schema(schema: List[Dict], chunk_size: int) -> List[List[Dict]]:
-    """Splits a large schema into a list of smaller schema chunks."""
-    if not schema:
-        return []
-    return [schema[i:i + chunk_size] for i in range(0, len(schema), chunk_size)]
+@functools.lru_cache(maxsize=4)
+def get_encoding(name: str = TOKENIZER_ENCODING) -> "tiktoken.Encoding":
+    """Loads a tiktoken encoding once; building its tables is slow enough to matter per call."""
+    return tiktoken.get_encoding(name)
 
-def create_messages(schema: List[Dict], num_records: int, start_id: int) -> List[Dict]:
-    """Creates the messages payload for the Chat Completions API."""
-    schema_with_id = copy.deepcopy(schema)
-    schema_with_id.insert(0, {
-        "name": "record_id",
-        "data_type": "Number",
-        "parameters": f"A unique numeric ID for each record, starting from {start_id} and incrementing by 1.",
-        "sample_data": start_id
-    })
-    schema_str = json.dumps(schema_with_id, indent=2)
-
-    system_prompt = """
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text))
+
+def pack_schema(schema: List[Dict], max_prompt_tokens: int = MAX_SCHEMA_PROMPT_TOKENS) -> List[List[Dict]]:
+    """Greedily packs schema columns into the fewest chunks whose serialized size fits the token budget."""
+    chunks: List[List[Dict]] = []
+    current: List[Dict] = []
+    current_tokens = 0
+    for column in schema:
+        column_tokens = count_tokens(orjson.dumps(column).decode())
+        if current and current_tokens + column_tokens > max_prompt_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(column)
+        current_tokens += column_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def build_response_format(schema: List[Dict]) -> Dict:
+    """Builds a strict structured-output format: an object whose `records` array holds one object per record."""
+    properties = {"record_id": {"type": "integer"}}
+    properties.update({item['name']: {"type": JSON_SCHEMA_TYPES.get(item['data_type'], "string")} for item in schema})
+    record_schema = {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "synthetic_records",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"records": {"type": "array", "items": record_schema}},
+                "required": ["records"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+# Identical for every call, so it opens every request's cacheable prompt prefix
+SYSTEM_PROMPT = """
     You are a high-quality synthetic data generation expert. Your task is to generate synthetic data records based on a provided schema.
     **CRITICAL Instructions:**
     1. Adhere strictly to the schema definition for each field.
-    2. Your output MUST be a single, valid JSON array of objects.
-    3. Do not include any text, explanations, or markdown formatting like ```json before or after the JSON array. Your response must be only the JSON.
+    2. Your output MUST be a JSON object whose `records` key holds the array of generated records.
     """
-    
-    user_prompt = f"""
-    Please generate **exactly {num_records}** records based on the following schema.
-    The `record_id` for this batch MUST start at {start_id} and increment sequentially.
+
+class AdaptiveBatchSize:
+    """Steers the records-per-call towards TARGET_BATCH_LATENCY using the latencies of recent calls."""
+
+    def __init__(self, initial: int = RECORDS_PER_API_CALL, window: int = 5):
+        # Kept fractional so small steps accumulate instead of being truncated away
+        self._size = float(initial)
+        self.latencies = deque(maxlen=window)
+
+    @property
+    def size(self) -> int:
+        """Records to request in the next call."""
+        return max(1, round(self._size))
+
+    def _clamp(self, size: float) -> float:
+        return min(max(size, MIN_RECORDS_PER_API_CALL), MAX_RECORDS_PER_API_CALL)
+
+    def record_success(self, latency: float):
+        """Grows the batch while calls beat the target latency and shrinks it when they run slower."""
+        self.latencies.append(latency)
+        avg_latency = sum(self.latencies) / len(self.latencies)
+        step = BATCH_ADAPTATION_RATE * (TARGET_BATCH_LATENCY - avg_latency) / TARGET_BATCH_LATENCY * self._size
+        self._size = self._clamp(self._size + step)
+
+    def record_failure(self):
+        """Halves the batch after a failed call (timeouts, 429s) so the endpoint can recover."""
+        self._size = self._clamp(self._size / 2)
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Seconds to wait before retrying: the server's Retry-After on a 429, otherwise capped exponential backoff with jitter."""
+    if isinstance(error, RateLimitError):
+        headers = error.response.headers
+        try:
+            if "retry-after-ms" in headers:
+                return float(headers["retry-after-ms"]) / 1000 + random.random() * 0.5
+            if "retry-after" in headers:
+                return float(headers["retry-after"]) + random.random() * 0.5
+        except ValueError:
+            pass  # e.g. an HTTP-date; fall back to exponential backoff
+    return min(2 ** attempt, 30) + random.random() * 0.5
+
+RECORD_ID_FIELD = {
+    "name": "record_id",
+    "data_type": "Number",
+    "parameters": "A unique numeric ID for each record, incrementing by 1.",
+    "sample_data": 1
+}
+
+def create_schema_prompt(schema: List[Dict]) -> str:
+    """Creates the schema message for a chunk; it is identical for every batch of that chunk."""
+    # Serializing never mutates, so prepend the shared record_id column instead of deep-copying
+    schema_str = orjson.dumps([RECORD_ID_FIELD, *schema]).decode()
+
+    return f"""
+    Generate records based on the following schema.
 
     **Schema:**
     {schema_str}
     """
+
+def create_messages(schema_prompt: str, num_records: int, start_id: int) -> List[Dict]:
+    """Creates the messages payload for the Chat Completions API."""
+    # Static system prompt and per-chunk schema first, so Azure OpenAI's automatic
+    # prompt caching can reuse that prefix; only the last message varies per batch
+    batch_prompt = f"""
+    Please generate **exactly {num_records}** records.
+    The `record_id` for this batch MUST start at {start_id} and increment sequentially.
+    """
     
     return [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": schema_prompt},
+        {"role": "user", "content": batch_prompt}
     ]
 
+def max_records_per_call(schema_prompt: str, num_columns: int) -> int:
+    """
+    Largest batch whose prompt plus estimated completion fits MODEL_CONTEXT_TOKENS,
+    counted once per chunk. Raises ValueError if not even one record fits, before any API call.
+    """
+    # The per-batch instruction message is tiny; count a worst-case rendering of it
+    prompt_tokens = sum(count_tokens(m["content"]) for m in create_messages(schema_prompt, MAX_RECORDS_PER_API_CALL, TOTAL_RECORDS_TO_GENERATE))
+    tokens_per_record = (num_columns + 1) * EST_OUTPUT_TOKENS_PER_FIELD  # +1 for record_id
+    max_records = (MODEL_CONTEXT_TOKENS - prompt_tokens) // tokens_per_record
+    if max_records < 1:
+        raise ValueError(f"Schema chunk prompt ({prompt_tokens} tokens) leaves no room for output in {MODEL_CONTEXT_TOKENS} tokens.")
+    return max_records
+
 async def generate_records_batch(
     semaphore: asyncio.Semaphore,
     client: AsyncAzureOpenAI,
     deployment_name: str,
-    schema: List[Dict],
+    schema_prompt: str,
+    response_format: Dict,
+    batch_size: AdaptiveBatchSize,
     num_records: int,
     start_id: int
 ) -> List[Dict]:
     """Generates a batch of records using Azure OpenAI, with a retry loop."""
     async with semaphore:
-        messages = create_messages(schema, num_records, start_id)
+        messages = create_messages(schema_prompt, num_records, start_id)
         for attempt in range(MAX_RETRIES_PER_BATCH):
+            error = None
             try:
-                print(f"-> Generating batch of {num_records} (ID: {start_id})... Attempt {attempt + 1}")
+                logger.debug(f"-> Generating batch of {num_records} (ID: {start_id})... Attempt {attempt + 1}")
                 
+                call_start = time.perf_counter()
                 response = await client.chat.completions.create(
                     model=deployment_name,
                     messages=messages,
                     temperature=0.7, # A little creativity
+                    response_format=response_format,
                 )
+                batch_size.record_success(time.perf_counter() - call_start)
                 
-                content = response.choices[0].message.content
-                cleaned_text = content.strip().replace("```json", "").replace("```", "").strip()
-                records = json.loads(cleaned_text)
+                # The server enforces the JSON schema, so the content parses as-is
+                records = orjson.loads(response.choices[0].message.content)["records"]
                 
                 # ✅ VALIDATION STEP
                 if isinstance(records, list) and len(records) == num_records:
-                    print(f"<- Success: Generated and parsed {len(records)} records (ID: {start_id}).")
+                    logger.debug(f"<- Success: Generated and parsed {len(records)} records (ID: {start_id}).")
                     return records
                 else:
-                    print(f"[WARNING] LLM returned {len(records)} records, expected {num_records}. Retrying...")
+                    logger.warning(f"LLM returned {len(records)} records, expected {num_records}. Retrying...")
             
             except Exception as e:
-                print(f"[ERROR] Attempt {attempt + 1} failed for batch (ID: {start_id}): {e}. Retrying...")
+                error = e
+                batch_size.record_failure()
+                logger.error(f"Attempt {attempt + 1} failed for batch (ID: {start_id}): {e}. Retrying...")
             
-            await asyncio.sleep(1) # Wait before retrying
+            if attempt + 1 < MAX_RETRIES_PER_BATCH:
+                await asyncio.sleep(retry_delay(error, attempt)) # Back off before retrying
 
-        print(f"[FATAL] Batch failed after {MAX_RETRIES_PER_BATCH} attempts (ID: {start_id}). Skipping.")
+        logger.error(f"Batch failed after {MAX_RETRIES_PER_BATCH} attempts (ID: {start_id}). Skipping.")
         return []
 
+async def generate_chunk(
+    semaphore: asyncio.Semaphore,
+    client: AsyncAzureOpenAI,
+    schema_prompt: str,
+    response_format: Dict,
+    batch_size: AdaptiveBatchSize,
+    max_batch_records: int,
+    on_records: Callable[[List[Dict]], None]
+):
+    """
+    Generates every record ID for one schema chunk, sizing each batch from the current adaptive size.
+    Each successful batch is handed to on_records as soon as it arrives.
+    """
+    next_id = 1
+
+    async def worker():
+        nonlocal next_id
+        while next_id <= TOTAL_RECORDS_TO_GENERATE:
+            # Claim the next ID range before awaiting, so workers never overlap
+            start_id = next_id
+            num_records = min(batch_size.size, max_batch_records, TOTAL_RECORDS_TO_GENERATE - start_id + 1)
+            next_id += num_records
+            on_records(await generate_records_batch(
+                semaphore, client, AZURE_OPENAI_DEPLOYMENT_NAME, schema_prompt, response_format,
+                batch_size, num_records, start_id
+            ))
+
+    await asyncio.gather(*(worker() for _ in range(MAX_CONCURRENT_REQUESTS)))
+
 async def main():
     """Main function to orchestrate chunking, generation, and merging."""
-    # Initialize the AsyncAzureOpenAI client
+    # Initialize the AsyncAzureOpenAI client on a shared HTTP/2 connection pool,
+    # sized to the request concurrency, so TCP/TLS handshakes are reused across batches
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=MAX_CONCURRENT_REQUESTS,
+            max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+        ),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
     client = AsyncAzureOpenAI(
         api_key=AZURE_OPENAI_KEY,
         azure_endpoint=AZURE_OPENAI_ENDPOINT,
         api_version=AZURE_OPENAI_API_VERSION,
+        http_client=http_client,
     )
     
     print("--- Starting Data Generation using Azure OpenAI ---")
-    start_time = time.time()
+    start_time = time.perf_counter()
     
-    schema_chunks = chunk_schema(HUGE_SCHEMA, SCHEMA_CHUNK_SIZE)
-    print(f"Schema has been split into {len(schema_chunks)} chunks of ~{SCHEMA_CHUNK_SIZE} columns each.")
+    schema_chunks = pack_schema(HUGE_SCHEMA)
+    print(f"Schema has been packed into {len(schema_chunks)} chunk(s) of at most {MAX_SCHEMA_PROMPT_TOKENS} tokens each.")
+    # The schema prompt and response format only depend on the chunk, so build them once each;
+    # checking the token budget here fails fast on oversized chunks before any request is sent
+    chunk_prompts = []
+    for schema_chunk in schema_chunks:
+        schema_prompt = create_schema_prompt(schema_chunk)
+        chunk_prompts.append((
+            schema_prompt, build_response_format(schema_chunk), max_records_per_call(schema_prompt, len(schema_chunk))
+        ))
 
-    final_records = {}
-    
-    for i, schema_chunk in enumerate(schema_chunks):
-        print(f"\n--- Processing Schema Chunk {i+1}/{len(schema_chunks)} ---")
-        
-        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-        tasks = []
-        
-        for batch_start_index in range(0, TOTAL_RECORDS_TO_GENERATE, RECORDS_PER_API_CALL):
-            records_in_this_batch = min(RECORDS_PER_API_CALL, TOTAL_RECORDS_TO_GENERATE - batch_start_index)
-            if records_in_this_batch > 0:
-                task = asyncio.create_task(
-                    generate_records_batch(
-                        semaphore, client, AZURE_OPENAI_DEPLOYMENT_NAME, schema_chunk, records_in_this_batch, batch_start_index + 1
-                    )
-                )
-                tasks.append(task)
-        
-        results_from_batches = await asyncio.gather(*tasks)
-        
-        for batch in results_from_batches:
-            for record in batch:
+    # Records still waiting for columns from other chunks, keyed by record_id:
+    # a column slot list plus the count of filled slots
+    pending_records: Dict[int, List[Any]] = {}
+    filled_slots: Dict[int, int] = {}
+    written = 0
+    sample = None
+    # One semaphore for the whole run caps in-flight requests across all chunks
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    # Every chunk hits the same deployment, so they share one batch-size controller
+    batch_size = AdaptiveBatchSize()
+
+    with open(OUTPUT_FILE, "wb") as out:
+        def write_record(record_id: int, slots: List[Any]):
+            nonlocal written, sample
+            # Only now build the dict, in schema column order
+            record = {"record_id": record_id}
+            record.update((name, value) for name, value in zip(COLUMN_NAMES, slots) if value is not MISSING)
+            # Small buffered writes; the file object flushes to disk in large blocks
+            out.write(orjson.dumps(record) + b"\n")
+            written += 1
+            if sample is None:
+                sample = record
+
+        def merge_records(records: List[Dict]):
+            """Merges one batch's columns in and streams every record that now has all of its columns."""
+            for record in records:
                 record_id = record.pop('record_id', None)
                 if record_id is None:
                     continue
-                if record_id not in final_records:
-                    final_records[record_id] = {}
-                final_records[record_id].update(record)
-    
-    all_generated_records = [final_records[i] for i in sorted(final_records.keys())]
-    end_time = time.time()
+                slots = pending_records.get(record_id)
+                if slots is None:
+                    slots = pending_records[record_id] = [MISSING] * len(COLUMN_NAMES)
+                    filled_slots[record_id] = 0
+                for name, value in record.items():
+                    col = COLUMN_INDEX.get(name)
+                    if col is not None and slots[col] is MISSING:
+                        slots[col] = value
+                        filled_slots[record_id] += 1
+                if filled_slots[record_id] == len(COLUMN_NAMES):
+                    del filled_slots[record_id]
+                    write_record(record_id, pending_records.pop(record_id))
+
+        try:
+            # Chunks are independent, so run them all at once rather than waiting
+            # for one chunk to finish before starting the next
+            print(f"\n--- Generating all {len(schema_chunks)} schema chunks concurrently ---")
+            await asyncio.gather(*(
+                generate_chunk(
+                    semaphore, client, schema_prompt, response_format, batch_size, max_batch_records, merge_records
+                )
+                for schema_prompt, response_format, max_batch_records in chunk_prompts
+            ))
+        finally:
+            await client.close()
+
+        # Keep partially generated records too (some chunk's batch failed for them)
+        incomplete = len(pending_records)
+        for record_id in sorted(pending_records):
+            write_record(record_id, pending_records[record_id])
+
+    end_time = time.perf_counter()
     
     print("\n--- ✅ Generation Complete ---")
-    print(f"Successfully generated {len(all_generated_records)} records.")
+    print(f"Successfully generated {written - incomplete} records ({incomplete} incomplete).")
     print(f"Total time taken: {end_time - start_time:.2f} seconds.")
     
-    if all_generated_records:
+    if sample is not None:
         print("\nSample of a final, merged record:")
-        print(json.dumps(all_generated_records[0], indent=2))
-            
-    with open("generated_data_azure.json", "w") as f:
-        json.dump(all_generated_records, f, indent=2)
-    print("\nFull dataset saved to 'generated_data_azure.json'")
+        print(orjson.dumps(sample, option=orjson.OPT_INDENT_2).decode())
+    print(f"\nFull dataset saved to '{OUTPUT_FILE}'")
 
 if __name__ == "__main__":
+    # Use uvloop's faster event loop when it's installed
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(main())
@@ -1,12 +1,20 @@
 import asyncio
-import json
+import logging
 import os
+import random
 import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 import copy
+from itertools import chain, islice
 
-# Make sure to pip install "openai>=1.0.0"
-from openai import AsyncAzureOpenAI
+# Make sure to pip install "openai>=1.0.0" orjson "httpx[http2]"
+import httpx
+import orjson
+from openai import AsyncAzureOpenAI, RateLimitError
+
+# Per-batch progress goes to DEBUG; set level=logging.DEBUG to follow every request
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 
@@ -35,6 +43,9 @@ HUGE_SCHEMA = [
     {"name": "Color", "data_type": "Text", "parameters": "Exterior color of the vehicle", "sample_data": "Blue"},
 ]
 
+# Maps schema data types to JSON Schema types for structured outputs
+JSON_SCHEMA_TYPES = {"Text": "string", "Number": "number", "Boolean": "boolean"}
+
 # --- Core Logic ---
 
 def chunk_schema(schema: List[Dict], chunk_size: int) -> List[List[Dict]]:
@@ -42,41 +53,87 @@ def chunk_schema(schema: List[Dict], chunk_size: int) -> List[List[Dict]]:
     if not schema: return []
     return [schema[i:i + chunk_size] for i in range(0, len(schema), chunk_size)]
 
-def create_messages(schema: List[Dict], num_records: int) -> List[Dict]:
-    """Creates the messages payload for the Chat Completions API."""
-    schema_str = json.dumps(schema, indent=2)
-    required_keys = [item['name'] for item in schema]
+def build_response_format(schema: List[Dict]) -> Dict:
+    """Builds a strict structured-output format: an object whose `records` array holds one object per record."""
+    record_schema = {
+        "type": "object",
+        "properties": {item['name']: {"type": JSON_SCHEMA_TYPES.get(item['data_type'], "string")} for item in schema},
+        "required": [item['name'] for item in schema],
+        "additionalProperties": False,
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "synthetic_records",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"records": {"type": "array", "items": record_schema}},
+                "required": ["records"],
+                "additionalProperties": False,
+            },
+        },
+    }
 
-    system_prompt = "You are a high-quality synthetic data generation expert. You follow instructions with extreme precision. Your output MUST be a single, valid JSON array of objects. Do not include any text, explanations, or markdown."
-    
-    user_prompt = f"""
-    Generate **exactly {num_records}** records based on the schema below.
-    **CRITICAL REQUIREMENT:** Every single JSON object in the output array MUST contain all of the following keys: {required_keys}
+# Identical for every call, so it opens every request's cacheable prompt prefix
+SYSTEM_PROMPT = "You are a high-quality synthetic data generation expert. You follow instructions with extreme precision. Your output MUST be a JSON object whose `records` key holds the array of generated records."
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Seconds to wait before retrying: the server's Retry-After on a 429, otherwise capped exponential backoff with jitter."""
+    if isinstance(error, RateLimitError):
+        headers = error.response.headers
+        try:
+            if "retry-after-ms" in headers:
+                return float(headers["retry-after-ms"]) / 1000 + random.random() * 0.5
+            if "retry-after" in headers:
+                return float(headers["retry-after"]) + random.random() * 0.5
+        except ValueError:
+            pass  # e.g. an HTTP-date; fall back to exponential backoff
+    return min(2 ** attempt, 30) + random.random() * 0.5
+
+def describe_schema(schema: List[Dict]) -> Tuple[str, List[str], Dict]:
+    """Builds a chunk's static schema prompt once, returning it with the required keys and response format."""
+    schema_str = orjson.dumps(schema).decode()
+    required_keys = [item['name'] for item in schema]
+    schema_prompt = f"""
+    Generate records based on the schema below.
+    **CRITICAL REQUIREMENT:** Every single JSON object in the `records` array MUST contain all of the following keys: {required_keys}
 
     **Schema:**
     {schema_str}
     """
-    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+    return schema_prompt, required_keys, build_response_format(schema)
+
+def create_messages(schema_prompt: str, num_records: int) -> List[Dict]:
+    """Creates the messages payload for the Chat Completions API."""
+    # Static system prompt and per-chunk schema first, so Azure OpenAI's automatic
+    # prompt caching can reuse that prefix; only the last message varies per batch
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": schema_prompt},
+        {"role": "user", "content": f"Generate **exactly {num_records}** records."}
+    ]
 
 async def generate_and_validate_batch(
     semaphore: asyncio.Semaphore,
     client: AsyncAzureOpenAI,
     deployment_name: str,
-    schema: List[Dict],
+    schema_prompt: str,
+    required_keys: List[str],
+    response_format: Dict,
     num_records: int
 ) -> List[Dict]:
     """Generates a single batch and validates it. Returns only the valid records."""
     async with semaphore:
-        messages = create_messages(schema, num_records)
-        expected_keys = {item['name'] for item in schema}
+        messages = create_messages(schema_prompt, num_records)
+        expected_keys = set(required_keys)
         try:
-            print(f"-> Requesting a batch of {num_records} records...")
+            logger.debug(f"-> Requesting a batch of {num_records} records...")
             response = await client.chat.completions.create(
-                model=deployment_name, messages=messages, temperature=0.8)
+                model=deployment_name, messages=messages, temperature=0.8, response_format=response_format)
             
-            content = response.choices[0].message.content
-            cleaned_text = content.strip().replace("```json", "").replace("```", "").strip()
-            all_records_in_batch = json.loads(cleaned_text)
+            # The server enforces the JSON schema, so the content parses as-is
+            all_records_in_batch = orjson.loads(response.choices[0].message.content)["records"]
 
             # Validate each record in the returned batch
             valid_records = []
@@ -84,58 +141,92 @@ async def generate_and_validate_batch(
                 for record in all_records_in_batch:
                     if isinstance(record, dict) and set(record.keys()) == expected_keys:
                         valid_records.append(record)
+                        # Extra records beyond the request would only be thrown away later
+                        if len(valid_records) == num_records:
+                            break
             
-            print(f"<- Received {len(all_records_in_batch)} records, {len(valid_records)} were valid.")
+            logger.debug(f"<- Received {len(all_records_in_batch)} records, {len(valid_records)} were valid.")
             return valid_records
         except Exception as e:
-            print(f"[ERROR] A batch generation request failed: {e}")
+            logger.error(f"A batch generation request failed: {e}")
+            if isinstance(e, RateLimitError):
+                # Hold this request slot until the endpoint is ready again, so the
+                # next retry round doesn't hit it with the same burst
+                await asyncio.sleep(retry_delay(e, 0))
             return []
 
+async def generate_chunk(
+    semaphore: asyncio.Semaphore,
+    client: AsyncAzureOpenAI,
+    schema_chunk: List[Dict],
+    chunk_number: int,
+    total_chunks: int
+) -> List[Dict]:
+    """Generates all records for one schema chunk, retrying until enough are valid. Returns [] on failure."""
+    print(f"\n--- Processing Schema Chunk {chunk_number}/{total_chunks} ---")
+
+    schema_prompt, required_keys, response_format = describe_schema(schema_chunk)
+    successful_records_for_chunk = []
+    attempts = 0
+
+    # Main retry loop for the current chunk
+    while len(successful_records_for_chunk) < TOTAL_RECORDS_TO_GENERATE and attempts < MAX_TOTAL_ATTEMPTS:
+        attempts += 1
+        records_needed = TOTAL_RECORDS_TO_GENERATE - len(successful_records_for_chunk)
+        print(f"\n[Chunk {chunk_number}, attempt {attempts}] Need to generate {records_needed} more records.")
+
+        tasks = []
+
+        # Create tasks to fetch the records we still need
+        for k in range(0, records_needed, RECORDS_PER_API_CALL):
+            batch_size = min(RECORDS_PER_API_CALL, records_needed - k)
+            task = asyncio.create_task(
+                generate_and_validate_batch(semaphore, client, AZURE_OPENAI_DEPLOYMENT_NAME, schema_prompt, required_keys, response_format, batch_size)
+            )
+            tasks.append(task)
+
+        # Gather results from all concurrent tasks
+        results_from_batches = await asyncio.gather(*tasks)
+
+        # Add the successfully generated records to our collection, only up to what was
+        # still needed, so the next round requests exactly the remaining gap
+        successful_records_for_chunk.extend(islice(chain.from_iterable(results_from_batches), records_needed))
+
+    if len(successful_records_for_chunk) < TOTAL_RECORDS_TO_GENERATE:
+        logger.error(f"Could not generate all records for chunk {chunk_number} after {MAX_TOTAL_ATTEMPTS} attempts.")
+        return []
+    return successful_records_for_chunk
+
 async def main():
     """Main function that now uses a loop to retry for failed records."""
-    client = AsyncAzureOpenAI(api_key=AZURE_OPENAI_KEY, azure_endpoint=AZURE_OPENAI_ENDPOINT, api_version=AZURE_OPENAI_API_VERSION)
+    # Reuse pooled HTTP/2 connections across every batch and retry round
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS, max_keepalive_connections=MAX_CONCURRENT_REQUESTS),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
+    client = AsyncAzureOpenAI(api_key=AZURE_OPENAI_KEY, azure_endpoint=AZURE_OPENAI_ENDPOINT, api_version=AZURE_OPENAI_API_VERSION, http_client=http_client)
     
     print("--- Starting Data Generation with Record-Level Retries ---")
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     schema_chunks = chunk_schema(HUGE_SCHEMA, SCHEMA_CHUNK_SIZE)
     # This dictionary will hold the final, merged records, keyed by a unique ID we assign
     final_records = {i: {} for i in range(TOTAL_RECORDS_TO_GENERATE)}
     
-    for i, schema_chunk in enumerate(schema_chunks):
-        print(f"\n--- Processing Schema Chunk {i+1}/{len(schema_chunks)} ---")
-        
-        successful_records_for_chunk = []
-        attempts = 0
-        
-        # NEW: Main retry loop for the current chunk
-        while len(successful_records_for_chunk) < TOTAL_RECORDS_TO_GENERATE and attempts < MAX_TOTAL_ATTEMPTS:
-            attempts += 1
-            records_needed = TOTAL_RECORDS_TO_GENERATE - len(successful_records_for_chunk)
-            print(f"\n[Attempt {attempts}] Need to generate {records_needed} more records for this chunk.")
-
-            semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-            tasks = []
-            
-            # Create tasks to fetch the records we still need
-            for k in range(0, records_needed, RECORDS_PER_API_CALL):
-                batch_size = min(RECORDS_PER_API_CALL, records_needed - k)
-                task = asyncio.create_task(
-                    generate_and_validate_batch(semaphore, client, AZURE_OPENAI_DEPLOYMENT_NAME, schema_chunk, batch_size)
-                )
-                tasks.append(task)
-            
-            # Gather results from all concurrent tasks
-            results_from_batches = await asyncio.gather(*tasks)
-            
-            # Add the successfully generated records to our collection
-            for batch in results_from_batches:
-                successful_records_for_chunk.extend(batch)
+    # One semaphore for the whole run caps in-flight requests across chunks and retry rounds
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
-        if len(successful_records_for_chunk) < TOTAL_RECORDS_TO_GENERATE:
-            print(f"[FATAL] Could not generate all records for chunk {i+1} after {MAX_TOTAL_ATTEMPTS} attempts.")
-            continue
-            
+    try:
+        # Chunks are independent, so run all of them (and their retry rounds) concurrently
+        chunk_results = await asyncio.gather(*(
+            generate_chunk(semaphore, client, schema_chunk, i + 1, len(schema_chunks))
+            for i, schema_chunk in enumerate(schema_chunks)
+        ))
+    finally:
+        await client.close()
+
+    for successful_records_for_chunk in chunk_results:
         # Merge the validated records from this chunk into the final dataset
         for idx, record_data in enumerate(successful_records_for_chunk):
              # We assume order is maintained to assign IDs
@@ -143,7 +234,7 @@ async def main():
                 final_records[idx].update(record_data)
 
     all_generated_records = list(final_records.values())
-    end_time = time.time()
+    end_time = time.perf_counter()
     
     print("\n--- ✅ Generation Complete ---")
     print(f"Successfully generated {len(all_generated_records)} records.")
@@ -151,11 +242,17 @@ async def main():
     
     if all_generated_records:
         print("\nSample of a final, merged record:")
-        print(json.dumps(all_generated_records[0], indent=2))
+        print(orjson.dumps(all_generated_records[0], option=orjson.OPT_INDENT_2).decode())
             
-    with open("generated_data_robust.json", "w") as f:
-        json.dump(all_generated_records, f, indent=2)
+    with open("generated_data_robust.json", "wb") as f:
+        f.write(orjson.dumps(all_generated_records, option=orjson.OPT_INDENT_2))
     print("\nFull dataset saved to 'generated_data_robust.json'")
 
 if __name__ == "__main__":
+    # Use uvloop's faster event loop when it's installed
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(main())
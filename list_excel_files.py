@@ -1,13 +1,13 @@
 import asyncio
-import fnmatch
 import logging
-from typing import Dict, List
-from io import BytesIO
+from itertools import chain
+from typing import AsyncIterator, Dict, List, Tuple
 import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
 
-import openpyxl  # pip install openpyxl
 from azure.identity.aio import DefaultAzureCredential
-from azure.storage.filedatalake.aio import DataLakeServiceClient
+from azure.storage.filedatalake.aio import DataLakeServiceClient, FileSystemClient
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,6 +17,17 @@ ACCOUNT_NAME = "your_account_name"
 FILE_SYSTEM_NAME = "your_file_system"
 ROOT_PATH = "your/root/folder/path"  # relative path in container
 
+# <sheet> elements in xl/workbook.xml live in the SpreadsheetML main namespace
+SHEET_TAG = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheet"
+
+def read_sheet_names(fileobj) -> List[str]:
+    """
+    Read sheet names straight from the xl/workbook.xml part of an .xlsx/.xlsm (zip) file,
+    without loading shared strings, styles or worksheets.
+    """
+    with zipfile.ZipFile(fileobj) as zf, zf.open("xl/workbook.xml") as wb_xml:
+        return [el.get("name") for el in ET.parse(wb_xml).getroot().iter(SHEET_TAG)]
+
 async def get_credential():
     """
     Create a credential object excluding unneeded credential types to speed up acquisition.
@@ -33,77 +44,81 @@ async def get_credential():
     )
     return cred
 
-async def list_excel_files(credential) -> List[str]:
+async def list_excel_files(fs_client: FileSystemClient) -> AsyncIterator[str]:
     """
     Recursively list all .xlsx/.xlsm files under ROOT_PATH in the ADLS file system.
-    Returns list of relative paths (inside file system).
+    Yields relative paths (inside file system) as the listing pages arrive.
     """
-    service_url = f"https://{ACCOUNT_NAME}.dfs.core.windows.net"
-    service_client = DataLakeServiceClient(account_url=service_url, credential=credential)
-    fs_client = service_client.get_file_system_client(FILE_SYSTEM_NAME)
-
-    paths = []
+    count = 0
     logger.info(f"Listing files under: {ROOT_PATH}")
     async for p in fs_client.get_paths(path=ROOT_PATH, recursive=True):
-        if not p.is_directory:
-            lower = p.name.lower()
-            if lower.endswith(".xlsx") or lower.endswith(".xlsm"):
-                paths.append(p.name)
-                logger.debug(f"Found excel file: {p.name}")
-    logger.info(f"Found {len(paths)} Excel files")
-    await service_client.close()
-    return paths
-
-async def get_sheet_names(credential, path: str) -> (str, List[str]):
+        if not p.is_directory and p.name.lower().endswith((".xlsx", ".xlsm")):
+            count += 1
+            logger.debug(f"Found excel file: {p.name}")
+            yield p.name
+    logger.info(f"Found {count} Excel files")
+
+async def get_sheet_names(fs_client: FileSystemClient, path: str) -> (str, List[str]):
     """
-    Download the file at 'path' from ADLS, load workbook in read-only mode and return its sheet names.
+    Download the file at 'path' from ADLS and return the sheet names listed in its workbook part.
     Returns (path, sheet_names_list).
     """
-    service_url = f"https://{ACCOUNT_NAME}.dfs.core.windows.net"
-    service_client = DataLakeServiceClient(account_url=service_url, credential=credential)
-    fs_client = service_client.get_file_system_client(FILE_SYSTEM_NAME)
     file_client = fs_client.get_file_client(path)
 
     logger.debug(f"Downloading file {path}")
-    download = await file_client.download_file()
-    data = await download.readall()
-    await service_client.close()
-
-    sheet_names: List[str] = []
-    try:
-        bio = BytesIO(data)
-        wb = openpyxl.load_workbook(filename=bio, read_only=True, data_only=True)
-        sheet_names = wb.sheetnames
-        wb.close()
-        logger.debug(f"{path} → sheets: {sheet_names}")
-    except Exception as e:
-        logger.error(f"Error reading workbook {path}: {e}")
-        sheet_names = []
+    # Download (up to 4 parallel range GETs) into a spooled temp file instead of
+    # holding the whole body in memory twice (readall() bytes + a BytesIO copy);
+    # workbooks over 16 MiB roll over to disk. readinto needs a seekable stream
+    # for parallel writes, which the spooled file is.
+    with tempfile.SpooledTemporaryFile(max_size=16 << 20) as tmp:
+        download = await file_client.download_file(max_concurrency=4)
+        await download.readinto(tmp)
+        tmp.seek(0)
+
+        sheet_names: List[str] = []
+        try:
+            sheet_names = read_sheet_names(tmp)
+            logger.debug(f"{path} → sheets: {sheet_names}")
+        except Exception as e:
+            logger.error(f"Error reading workbook {path}: {e}")
+            sheet_names = []
 
     return path, sheet_names
 
-async def process_files(credential, file_paths: List[str], max_concurrency: int = 10) -> Dict[str, List[str]]:
+async def process_files(fs_client: FileSystemClient, file_paths: AsyncIterator[str], max_concurrency: int = 10) -> Dict[str, List[str]]:
     """
-    Process list of file_paths concurrently (up to max_concurrency) to extract sheet names.
+    Process file_paths concurrently (up to max_concurrency) to extract sheet names.
+    Downloads start while the listing is still running: the paths go through a
+    bounded queue, so a slow consumer also throttles the listing.
     Returns dict { path: [sheet_names] }.
     """
-    semaphore = asyncio.Semaphore(max_concurrency)
-    result: Dict[str, List[str]] = {}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_concurrency * 2)
 
-    async def _worker(path):
-        async with semaphore:
-            p, names = await get_sheet_names(credential, path)
-            result[p] = names
+    async def _producer():
+        async for path in file_paths:
+            await queue.put(path)
+        # One sentinel per worker marks the end of the listing
+        for _ in range(max_concurrency):
+            await queue.put(None)
 
-    tasks = [ _worker(fp) for fp in file_paths ]
-    await asyncio.gather(*tasks)
-    return result
+    async def _worker() -> List[Tuple[str, List[str]]]:
+        # Each worker returns its own (path, sheet_names) pairs instead of writing to a shared dict
+        pairs = []
+        while (path := await queue.get()) is not None:
+            pairs.append(await get_sheet_names(fs_client, path))
+        return pairs
+
+    _, *per_worker = await asyncio.gather(_producer(), *(_worker() for _ in range(max_concurrency)))
+    return dict(chain.from_iterable(per_worker))
 
 async def main() -> Dict[str, List[str]]:
     credential = await get_credential()
+    service_url = f"https://{ACCOUNT_NAME}.dfs.core.windows.net"
     try:
-        files = await list_excel_files(credential)
-        sheet_dict = await process_files(credential, files, max_concurrency=20)
+        # One service client (and its connection pool) serves the listing and every download
+        async with DataLakeServiceClient(account_url=service_url, credential=credential) as service_client:
+            fs_client = service_client.get_file_system_client(FILE_SYSTEM_NAME)
+            sheet_dict = await process_files(fs_client, list_excel_files(fs_client), max_concurrency=20)
     finally:
         # Close credential if it has close() (async credential supports .close())
         try:
@@ -114,6 +129,12 @@ async def main() -> Dict[str, List[str]]:
     return sheet_dict
 
 if __name__ == "__main__":
+    # Use uvloop's faster event loop when it's installed
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     sheet_map = asyncio.run(main())
     import json
     print(json.dumps(sheet_map, indent=2))
@@ -1,41 +1,261 @@
+# Pure-Python tree walk and JSON emitter, plus a small file-conversion CLI; fully
+# annotated so it can be compiled to a C extension with `mypyc md.py`
+# (pip install mypy), which imports in its place.
+import functools
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
 import mistletoe
 from mistletoe import Document
-import json
+try:
+    import orjson  # pip install orjson
+    _HAVE_ORJSON = True
+except ImportError:
+    _HAVE_ORJSON = False
+
+# JSON helpers, all producing bytes: orjson when it's installed, stdlib json otherwise
+def _dumps(obj: Any) -> bytes:
+    if _HAVE_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+def _dumps_indented(obj: Any) -> bytes:
+    if _HAVE_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode()
+
+def _loads(data: bytes) -> Any:
+    if _HAVE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# getattr default for "attribute not present", so each probe is a single lookup
+_MISSING: Any = object()
+
+# Per node class, the emitter's encoded '{"type":...' prefix
+_TYPE_PREFIXES: Dict[type, bytes] = {}
+
+def _type_prefix(cls: type) -> bytes:
+    prefix = _TYPE_PREFIXES.get(cls)
+    if prefix is None:
+        prefix = _TYPE_PREFIXES[cls] = b'{"type":' + _dumps(cls.__name__)
+    return prefix
 
-def node_to_json(node):
+def nodes_to_json(nodes: Any) -> List[Dict[str, Any]]:
+    """
+    Convert a sequence of sibling mistletoe AST nodes (and their subtrees) in one
+    preorder walk with an explicit stack, so deeply nested documents don't hit the
+    recursion limit.
+    """
+    nodes = list(nodes)
+    result: List[Dict[str, Any]] = [{} for _ in nodes]
+    # Each entry pairs a node with the (still empty) dict it is converted into;
+    # pushed in reverse so nodes are converted in document order
+    stack: List[Tuple[Any, Dict[str, Any]]] = list(zip(reversed(nodes), reversed(result)))
+    while stack:
+        node, d = stack.pop()
+        d["type"] = type(node).__name__
+        # If node has simple content (some nodes do)
+        content = getattr(node, "content", _MISSING)
+        if content is not _MISSING:
+            d["content"] = content
+
+        # If node has children (block or inline), traverse them
+        # Some versions use `children` property as list or None
+        children = getattr(node, "children", None)
+        if children:
+            children = list(children)
+            child_dicts: List[Dict[str, Any]] = [{} for _ in children]
+            d["children"] = child_dicts
+            stack.extend(zip(reversed(children), reversed(child_dicts)))
+
+        # Additional properties: you can capture specific attributes if existing
+        # For example, headings might have .level
+        level = getattr(node, "level", _MISSING)
+        if level is not _MISSING:
+            d["level"] = level
+        language = getattr(node, "language", _MISSING)
+        if language is not _MISSING:
+            d["language"] = language
+        # List.start is the first item number; on other block tokens "start" is the
+        # classmethod mistletoe uses to recognise the block, not data
+        start = getattr(node, "start", _MISSING)
+        if start is not _MISSING and not callable(start):
+            d["start"] = start
+
+    return result
+
+def node_to_json(node: Any) -> Dict[str, Any]:
     """
     Generic conversion of a mistletoe AST node to JSON-serializable dict.
     """
-    d = {
-        "type": type(node).__name__
-    }
-    # If node has simple content (some nodes do)
-    if hasattr(node, "content"):
-        d["content"] = node.content
-
-    # If node has children (block or inline), traverse them
-    # Some versions use `children` property as list or None
-    children = getattr(node, "children", None)
-    if children:
-        d["children"] = [node_to_json(child) for child in children]
-
-    # Additional properties: you can capture specific attributes if existing
-    # For example, headings might have .level
-    if hasattr(node, "level"):
-        d["level"] = node.level
-    if hasattr(node, "language"):
-        d["language"] = node.language
-    if hasattr(node, "start"):
-        d["start"] = node.start
-
-    return d
-
-def markdown_to_json(md_text: str):
+    return nodes_to_json((node,))[0]
+
+def nodes_to_json_bytes(nodes: Any) -> bytes:
+    """
+    Serialize a sequence of sibling mistletoe AST nodes straight to compact JSON,
+    with the same keys as nodes_to_json but without building the dicts first.
+    """
+    out: List[bytes] = []
+    write = out.append
+    # Entries are either nodes still to emit or literal JSON (commas, closing
+    # brackets, trailing keys) to write once everything pushed above them is done
+    stack: List[Any] = [b"]"]
+    nodes = list(nodes)
+    for i in range(len(nodes) - 1, -1, -1):
+        stack.append(nodes[i])
+        if i:
+            stack.append(b",")
+    write(b"[")
+    while stack:
+        node = stack.pop()
+        if type(node) is bytes:
+            write(node)
+            continue
+        write(_type_prefix(type(node)))
+        content = getattr(node, "content", _MISSING)
+        if content is not _MISSING:
+            write(b',"content":' + _dumps(content))
+
+        # Keys after "children" are known now, so queue them to close the object
+        tail = b""
+        level = getattr(node, "level", _MISSING)
+        if level is not _MISSING:
+            tail += b',"level":' + _dumps(level)
+        language = getattr(node, "language", _MISSING)
+        if language is not _MISSING:
+            tail += b',"language":' + _dumps(language)
+        start = getattr(node, "start", _MISSING)
+        if start is not _MISSING and not callable(start):
+            tail += b',"start":' + _dumps(start)
+        tail += b"}"
+
+        children = getattr(node, "children", None)
+        if children:
+            children = list(children)
+            write(b',"children":[')
+            stack.append(b"]" + tail)
+            for i in range(len(children) - 1, -1, -1):
+                stack.append(children[i])
+                if i:
+                    stack.append(b",")
+        else:
+            write(tail)
+    return b"".join(out)
+
+@functools.lru_cache(maxsize=256)
+def _markdown_to_json_bytes(md_text: str) -> bytes:
     doc = Document(md_text)
-    # root children are block tokens
-    return [node_to_json(child) for child in doc.children]
+    # root children are block tokens; emit them all in a single walk
+    return nodes_to_json_bytes(doc.children)
+
+def markdown_to_json(md_text: str) -> List[Dict[str, Any]]:
+    # Repeated texts (preview/build loops) skip the parse and tree walk; the cache
+    # holds serialized JSON so every caller still gets its own mutable copy
+    return _loads(_markdown_to_json_bytes(md_text))
+
+# Top-level block boundaries for split_blocks
+_FENCE_OPEN = re.compile(r" {0,3}(`{3,}|~{3,})")
+_LIST_ITEM = re.compile(r"(?:[-+*]|[0-9]{0,9}[.)])(?:[ \t]|$)")
+# Link reference definitions and HTML blocks reach across blank lines, and an
+# indented fence may belong to a list item the line scan below can't follow
+_CROSS_BLOCK = re.compile(r"^(?: {0,3}(?:<|\[[^\]]+\]:)| {1,3}(?:`{3}|~{3}))", re.MULTILINE)
+
+def split_blocks(md_text: str) -> List[str]:
+    """
+    Split markdown at the blank lines that always end the top-level block before them,
+    so each piece parses to the same tokens on its own as inside the whole text. Blank
+    lines inside fenced code, or followed by an indented line or a list item (which can
+    continue the previous block), don't split; text with link reference definitions,
+    HTML blocks or indented fences stays in one piece.
+    """
+    if _CROSS_BLOCK.search(md_text):
+        return [md_text]
+    blocks: List[str] = []
+    current: List[str] = []
+    fence = ""
+    blank = False
+    has_content = False
+    for line in md_text.splitlines(keepends=True):
+        if fence:
+            # closed the way mistletoe closes it: the fence's delimiter starting a
+            # single-word line indented less than four spaces
+            rest = line.lstrip(" ")
+            if len(line) - len(rest) < 4 and rest.startswith(fence) and len(rest.split(maxsplit=1)) == 1:
+                fence = ""
+        elif not line.strip():
+            blank = True
+        else:
+            if blank and has_content and line[0] not in " \t" and not _LIST_ITEM.match(line):
+                while not current[-1].strip():
+                    current.pop()
+                blocks.append("".join(current))
+                current = []
+            blank = False
+            has_content = True
+            m = _FENCE_OPEN.match(line)
+            # a backtick fence's info string can't contain backticks
+            if m and not (m.group(1)[0] == "`" and "`" in line[m.end():]):
+                fence = m.group(1)
+        current.append(line)
+    if current:
+        blocks.append("".join(current))
+    return blocks
+
+class IncrementalMarkdownParser:
+    """
+    markdown_to_json for text that is re-converted as it grows or changes near the end
+    (live previews, streamed output): blocks unchanged since the previous call reuse
+    their JSON and only the blocks after them are parsed again.
+    """
+
+    def __init__(self) -> None:
+        self._blocks: List[str] = []
+        self._block_json: List[bytes] = []
+
+    def markdown_to_json(self, md_text: str) -> List[Dict[str, Any]]:
+        blocks = split_blocks(md_text)
+        # longest run of leading blocks identical to the previous call's
+        k = 0
+        limit = min(len(blocks), len(self._blocks))
+        while k < limit and blocks[k] == self._blocks[k]:
+            k += 1
+        block_json = self._block_json[:k]
+        for block in blocks[k:]:
+            # the block's root tokens as JSON, without the enclosing brackets
+            block_json.append(nodes_to_json_bytes(Document(block).children)[1:-1])
+        self._blocks = blocks
+        self._block_json = block_json
+        return _loads(b"[" + b",".join(j for j in block_json if j) + b"]")
+
+def convert_file(path: Path) -> None:
+    """
+    Convert the markdown file at `path` and write the JSON next to it (same name, .json suffix).
+    """
+    md_text = path.read_text(encoding="utf-8")
+    path.with_suffix(".json").write_bytes(
+        _dumps_indented(markdown_to_json(md_text))
+    )
 
 if __name__ == "__main__":
+    # `python md.py a.md b.md ...` converts each file; parsing is CPU-bound,
+    # so files are spread over one process per core
+    if len(sys.argv) > 1:
+        paths = [Path(arg) for arg in sys.argv[1:]]
+        workers = min(os.cpu_count() or 1, len(paths))
+        # several files per task to cut IPC on long lists, but never so many that
+        # some workers are left without any
+        chunksize = max(1, len(paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, _ in zip(paths, pool.map(convert_file, paths, chunksize=chunksize)):
+                print(f"Converted {path} -> {path.with_suffix('.json')}")
+        sys.exit(0)
+
     md = """
 ## 1. Introduction
 
@@ -53,4 +273,4 @@ The purpose of this document is ...
 | JIRA Ticket           | **[PLACEHOLDER]**        |
 """
     js = markdown_to_json(md)
-    print(json.dumps(js, indent=2))
+    print(_dumps_indented(js).decode())
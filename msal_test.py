@@ -1,16 +1,52 @@
+import asyncio
 import msal
+from msal_extensions import PersistedTokenCache, build_encrypted_persistence  # pip install msal-extensions
 
-def get_token_device_code(client_id, tenant_id, scopes):
+# Token cache file, encrypted with DPAPI / Keychain / libsecret depending on the OS, so
+# later runs can refresh silently instead of repeating the device flow
+TOKEN_CACHE_PATH = "msal_token_cache.bin"
+
+# Errors the token endpoint returns while the user hasn't finished signing in yet
+DEVICE_FLOW_PENDING_ERRORS = ("authorization_pending", "slow_down")
+
+def build_token_cache(path=TOKEN_CACHE_PATH):
+    try:
+        return PersistedTokenCache(build_encrypted_persistence(path))
+    except Exception as e:
+        # e.g. no keyring available on a headless Linux box: keep the token in memory only
+        print("Persistent token cache unavailable, using an in-memory cache:", e)
+        return msal.TokenCache()
+
+async def get_token_device_code_async(client_id, tenant_id, scopes):
     authority = f"https://login.microsoftonline.com/{tenant_id}"
-    app = msal.PublicClientApplication(client_id, authority=authority)
+    app = msal.PublicClientApplication(client_id, authority=authority, token_cache=build_token_cache())
 
-    flow = app.initiate_device_flow(scopes=scopes)
+    # A cached account from an earlier run can usually get a token from its refresh token
+    accounts = await asyncio.to_thread(app.get_accounts)
+    if accounts:
+        result = await asyncio.to_thread(app.acquire_token_silent, scopes, account=accounts[0])
+        if result and "access_token" in result:
+            return result["access_token"]
+
+    flow = await asyncio.to_thread(app.initiate_device_flow, scopes=scopes)
     if "user_code" not in flow:
         print("Failed to start device flow:", flow)
         return None
 
     print(flow["message"])
-    result = app.acquire_token_by_device_flow(flow)
+    # Poll the token endpoint ourselves: exit_condition makes MSAL return after a single
+    # request instead of sleeping in its own loop, and the wait between polls is an
+    # asyncio.sleep, so the event loop stays free for other work
+    interval = flow.get("interval", 5)
+    while True:
+        result = await asyncio.to_thread(
+            app.acquire_token_by_device_flow, flow, exit_condition=lambda flow: True
+        )
+        if result.get("error") not in DEVICE_FLOW_PENDING_ERRORS:
+            break
+        if result.get("error") == "slow_down":
+            interval += 5  # RFC 8628: back off by 5 seconds when asked to slow down
+        await asyncio.sleep(interval)
 
     # Debug: print full result
     print("Result of acquire_token_by_device_flow:", result)
@@ -22,6 +58,9 @@ def get_token_device_code(client_id, tenant_id, scopes):
         print("Error description:", result.get("error_description"))
         return None
 
+def get_token_device_code(client_id, tenant_id, scopes):
+    return asyncio.run(get_token_device_code_async(client_id, tenant_id, scopes))
+
 if __name__ == "__main__":
     CLIENT_ID = "your-client-id-here"
     TENANT_ID = "your-tenant-id-here"
@@ -1,6 +1,11 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 import pypdf                 # Used for the (unreliable) text replacement
 import pypdfium2 as pdfium   # Used for the image rendering
+try:
+    import pyvips            # Optional: libvips' SIMD, multi-threaded encoders (pip install pyvips)
+except (ImportError, OSError):  # OSError: the libvips shared library itself is missing
+    pyvips = None
 
 # --- Configuration ---
 INPUT_FILE = "input.pdf"       # Your source PDF
@@ -10,8 +15,64 @@ REPLACE_TEXT = "Pepsico"
 OUTPUT_PREFIX = "output_page"  # e.g., output_page_1.png
 IMAGE_FORMAT = "png"
 DPI_SCALE = 2  # Renders at 144 DPI (72 DPI * 2). Increase for higher quality.
+JPEG_QUALITY = 85  # Only used when IMAGE_FORMAT is "jpg"/"jpeg"
 # ---
 
+# Encoder options per format: default deflate level for PNG; single-pass baseline
+# JPEG (no optimize/progressive, which would add extra Huffman passes)
+PIL_SAVE_OPTIONS = {
+    "png": {"compress_level": 6},
+    "jpg": {"quality": JPEG_QUALITY, "optimize": False, "progressive": False},
+    "jpeg": {"quality": JPEG_QUALITY, "optimize": False, "progressive": False},
+}
+VIPS_SAVE_OPTIONS = {
+    "png": {"compression": 6},
+    "jpg": {"Q": JPEG_QUALITY},
+    "jpeg": {"Q": JPEG_QUALITY},
+}
+
+# Each render worker process opens its own document once (pdfium handles can't be
+# shared across processes) and renders whichever pages it is handed
+_worker_pdf = None
+
+def _open_worker_document(pdf_path):
+    global _worker_pdf
+    _worker_pdf = pdfium.PdfDocument(pdf_path)
+
+def _save_bitmap(bitmap, output_filename):
+    """
+    Encodes a rendered bitmap with libvips when it's available and the rows are
+    unpadded, falling back to PIL otherwise.
+    """
+    fmt = IMAGE_FORMAT.lower()
+    bands = len(bitmap.mode)
+    if pyvips is not None and bitmap.stride == bitmap.width * bands:
+        image = pyvips.Image.new_from_memory(bitmap.buffer, bitmap.width, bitmap.height, bands, "uchar")
+        image.write_to_file(output_filename, **VIPS_SAVE_OPTIONS.get(fmt, {}))
+    else:
+        # Image.frombuffer over pdfium's buffer (no render_topil round trip)
+        bitmap.to_pil().save(output_filename, **PIL_SAVE_OPTIONS.get(fmt, {}))
+
+def _render_page(page_index):
+    """
+    Renders one page in a worker process and saves it there, so only the
+    output filename (not the bitmap) travels back to the parent.
+    """
+    page = _worker_pdf.get_page(page_index)
+
+    # Render the page to a bitmap; rev_byteorder makes pdfium write RGB directly,
+    # so PIL can take the pixels as-is instead of swapping channels from BGR
+    bitmap = page.render(scale=DPI_SCALE, rev_byteorder=True)
+
+    # Save the rendered image
+    output_filename = f"{OUTPUT_PREFIX}_{page_index + 1}.{IMAGE_FORMAT}"
+    _save_bitmap(bitmap, output_filename)
+
+    # Clean up page and bitmap objects
+    bitmap.close()
+    page.close()
+    return output_filename
+
 def pypdf_replace_and_render():
     """
     Attempts text replacement using pypdf and renders pages using PyPdfium2.
@@ -68,22 +129,11 @@ def pypdf_replace_and_render():
         n_pages = len(pdf)
         print(f"Found {n_pages} pages. Rendering...")
 
-        for i in range(n_pages):
-            page_number = i + 1
-            page = pdf.get_page(i)
-            
-            # Render the page to a bitmap
-            bitmap = page.render(scale=DPI_SCALE) 
-            
-            # Save the rendered image
-            output_filename = f"{OUTPUT_PREFIX}_{page_number}.{IMAGE_FORMAT}"
-            bitmap.save(output_filename)
-            
-            print(f"Saved {output_filename}")
-            
-            # Clean up page and bitmap objects
-            bitmap.close()
-            page.close()
+        # Pages are independent and rendering is CPU-bound, so spread them over one process per core
+        workers = min(os.cpu_count() or 1, n_pages) or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_document, initargs=(TEMP_FILE,)) as pool:
+            for output_filename in pool.map(_render_page, range(n_pages)):
+                print(f"Saved {output_filename}")
         
         print(f"\nSuccessfully created {n_pages} images.")
 
@@ -1,6 +1,29 @@
 # pip install python-pptx
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from lxml import etree  # installed with python-pptx
 from pptx import Presentation
-from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.text.text import _Paragraph
+
+# DrawingML text lives in <a:p> paragraphs of <a:r> runs, each holding one <a:t>,
+# wherever it sits (text frames, table cells, grouped shapes)
+_NS = {"a": "http://schemas.openxmlformats.org/drawingml/2006/main"}
+_PARAGRAPHS = etree.XPath(".//a:p[a:r/a:t]", namespaces=_NS)  # only paragraphs with run text
+_RUN_TEXTS = etree.XPath("./a:r/a:t", namespaces=_NS)
+_ALL_RUN_STRINGS = etree.XPath(".//a:r/a:t/text()", namespaces=_NS, smart_strings=False)
+
+def compile_placeholders(mapping):
+    """
+    Build one regex matching any placeholder in mapping, so all of them are found
+    in a single scan. Longer placeholders come first, so one that starts with
+    another is not cut short. Returns None when there is nothing to replace.
+    """
+    keys = sorted((k for k in mapping if k), key=len, reverse=True)
+    if not keys:
+        return None
+    return re.compile('|'.join(map(re.escape, keys)))
 
 def replace_in_paragraph(paragraph, placeholder, replacement):
     """
@@ -8,41 +31,43 @@ def replace_in_paragraph(paragraph, placeholder, replacement):
     where the placeholder spans multiple runs.
     Replacement inherits formatting of the run where the placeholder starts.
     """
-    # keep trying until no placeholder remains in this paragraph
-    while True:
-        runs = list(paragraph.runs)
-        if not runs:
-            return
-        full = ''.join([r.text or '' for r in runs])
-        idx = full.find(placeholder)
-        if idx == -1:
-            return
+    mapping = {placeholder: replacement}
+    pattern = compile_placeholders(mapping)
+    if pattern is not None:
+        replace_matches_in_paragraph(paragraph, pattern, mapping)
+
+def replace_matches_in_paragraph(paragraph, pattern, mapping):
+    """
+    Replace all placeholder matches of pattern in the paragraph with their mapping
+    value, handling cases where a placeholder spans multiple runs.
+    Replacement inherits formatting of the run where the placeholder starts.
+    """
+    runs = list(paragraph.runs)
+    if not runs:
+        return
+    # read each run's text once; python-pptx fetches it from the XML on every access
+    original = [r.text or '' for r in runs]
+    full = ''.join(original)
+
+    # find every occurrence in a single scan of the joined text
+    matches = [(m.start(), m.end(), mapping[m.group()]) for m in pattern.finditer(full)]
+    if not matches:
+        return
 
-        plen = len(placeholder)
-        # compute cumulative lengths of runs
-        cum = []
-        total = 0
-        for r in runs:
-            txt = r.text or ''
-            total += len(txt)
-            cum.append(total)
-
-        start = idx
-        end = idx + plen  # exclusive
-
-        # find start run index
-        for si, c in enumerate(cum):
-            if c > start:
-                start_i = si
-                break
-        # find end run index
-        for ei, c in enumerate(cum):
-            if c >= end:
-                end_i = ei
-                break
-
-        start_run = runs[start_i]
-        end_run = runs[end_i]
+    # compute cumulative lengths of runs once
+    cum = []
+    total = 0
+    for txt in original:
+        total += len(txt)
+        cum.append(total)
+
+    texts = list(original)
+    dropped = set()  # intermediate runs swallowed entirely by a placeholder
+    # apply back to front, so the offsets of earlier matches stay valid
+    for start, end, replacement in reversed(matches):
+        # first run ending after start / first run ending at or after end (exclusive)
+        start_i = bisect_right(cum, start)
+        end_i = bisect_left(cum, end)
 
         # offsets inside start/end runs
         start_offset = start - (cum[start_i - 1] if start_i > 0 else 0)
@@ -50,71 +75,147 @@ def replace_in_paragraph(paragraph, placeholder, replacement):
 
         if start_i == end_i:
             # placeholder entirely inside one run -> simple replacement (keeps that run's formatting)
-            s = start_run.text or ''
-            start_run.text = s[:start_offset] + replacement + s[end_offset:]
+            s = texts[start_i]
+            texts[start_i] = s[:start_offset] + replacement + s[end_offset:]
         else:
-            # spanning runs:
-            start_txt = start_run.text or ''
-            end_txt = end_run.text or ''
+            # spanning runs: put replacement into the start run (inherits its formatting),
+            # drop intermediate runs and keep the suffix in the end run
+            suffix = texts[end_i][end_offset:]
+            texts[start_i] = texts[start_i][:start_offset] + replacement
+            dropped.update(range(start_i + 1, end_i))
+            texts[end_i] = suffix
+
+    # write back only the runs that changed; remove dropped <a:r> elements from the
+    # XML rather than leaving them behind empty
+    for i, (run, old, new) in enumerate(zip(runs, original, texts)):
+        if i in dropped:
+            r = run._r
+            r.getparent().remove(r)
+        elif new != old:
+            run.text = new
 
-            prefix = start_txt[:start_offset]
-            suffix = end_txt[end_offset:]
+def replace_in_element(element, pattern, mapping):
+    """
+    Replace placeholders in every paragraph under an lxml element (a shape or a whole
+    slide, layout, master or notes part), working on the <a:t> elements directly.
+    """
+    # Most parts and shapes don't contain any placeholder at all: one C-level text
+    # fetch decides that before any per-paragraph work
+    if pattern.search(''.join(_ALL_RUN_STRINGS(element))) is None:
+        return
+    replace_in_paragraph_elements(_PARAGRAPHS(element), pattern, mapping)
 
-            # put replacement into the start_run (inherits its formatting)
-            start_run.text = prefix + replacement
-            # clear intermediate runs
-            for i in range(start_i + 1, end_i):
-                runs[i].text = ''
-            # set suffix into end_run
-            end_run.text = suffix
+def replace_in_paragraph_elements(paragraphs, pattern, mapping):
+    """
+    Replace placeholders in a sequence of <a:p> elements, rewriting <a:t> text directly
+    when every match sits inside one run.
+    """
+    for p in paragraphs:
+        texts = _RUN_TEXTS(p)
+        strings = [t.text or '' for t in texts]
+        matches = [(m.start(), m.end(), mapping[m.group()]) for m in pattern.finditer(''.join(strings))]
+        if not matches:
+            continue
+        cum = list(accumulate(map(len, strings)))
+        # run holding each match's first character; a match fits in that run when
+        # its last character is there too
+        run_of = [bisect_right(cum, start) for start, _, _ in matches]
+        if all(bisect_left(cum, end) == i for (_, end, _), i in zip(matches, run_of)):
+            # splice the replacements into their runs' XML text, back to front so
+            # earlier offsets stay valid
+            new = list(strings)
+            for (start, end, replacement), i in zip(reversed(matches), reversed(run_of)):
+                offset = cum[i - 1] if i else 0
+                new[i] = new[i][:start - offset] + replacement + new[i][end - offset:]
+            for t, old, text in zip(texts, strings, new):
+                if text != old:
+                    t.text = text
+        else:
+            # some occurrence spans runs: let the run-aware path handle this paragraph
+            replace_matches_in_paragraph(_Paragraph(p, None), pattern, mapping)
 
 def replace_in_shape(shape, placeholder, replacement):
     """
-    Recursively replace text in a shape (text frames, tables, groups).
+    Replace text in a shape (text frames, tables, groups).
+    """
+    mapping = {placeholder: replacement}
+    pattern = compile_placeholders(mapping)
+    if pattern is not None:
+        replace_in_element(shape.element, pattern, mapping)
+
+class PptxEditor:
+    """
+    Open a presentation once, apply any number of replacements, and save it once on
+    a clean exit:
+
+        with PptxEditor("in.pptx", "out.pptx") as editor:
+            editor.replace("{{NAME}}", "Bob")
+            editor.replace_many({"{{DATE}}": "today", "{{CITY}}": "Oslo"})
     """
-    # Text in regular text-carrying shapes
-    if getattr(shape, "has_text_frame", False):
-        for para in shape.text_frame.paragraphs:
-            replace_in_paragraph(para, placeholder, replacement)
 
-    # Tables (graphic frames)
-    if getattr(shape, "has_table", False):
-        table = shape.table
-        for row in table.rows:
-            for cell in row.cells:
-                for para in cell.text_frame.paragraphs:
-                    replace_in_paragraph(para, placeholder, replacement)
+    def __init__(self, input_path, output_path):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.prs = None
+        self._paragraphs = None
 
-    # Group shapes: recurse into contained shapes
-    if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
-        for shp in shape.shapes:
-            replace_in_shape(shp, placeholder, replacement)
+    def __enter__(self):
+        self.prs = Presentation(self.input_path)
+        return self
 
-def replace_placeholder_in_presentation(input_path, output_path, placeholder, replacement):
-    prs = Presentation(input_path)
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.prs.save(self.output_path)
+            print(f"Saved replaced PPTX -> {self.output_path}")
+        return False
 
-    # Replace inside slide layouts & master (in case placeholder sits in layout/master)
-    for layout in prs.slide_layouts:
-        for shape in layout.shapes:
-            replace_in_shape(shape, placeholder, replacement)
-    for shape in prs.slide_master.shapes:
-        replace_in_shape(shape, placeholder, replacement)
+    def _part_elements(self):
+        """Root XML elements of every part that can hold text, layouts and master first."""
+        for layout in self.prs.slide_layouts:
+            yield layout.element
+        yield self.prs.slide_master.element
+        for slide in self.prs.slides:
+            yield slide.element
+            if slide.has_notes_slide:
+                yield slide.notes_slide.element
 
-    # Replace on slides and notes
-    for slide in prs.slides:
-        for shape in slide.shapes:
-            replace_in_shape(shape, placeholder, replacement)
+    def _text_paragraphs(self):
+        """
+        Flat list of every <a:p> with run text in the presentation, collected on first use
+        with one XPath walk per part (covering all shapes, tables and groups). Replacements
+        only ever change runs inside these paragraphs, so the list stays valid.
+        """
+        if self._paragraphs is None:
+            self._paragraphs = [p for element in self._part_elements() for p in _PARAGRAPHS(element)]
+        return self._paragraphs
 
-        if slide.has_notes_slide:
-            for shape in slide.notes_slide.shapes:
-                replace_in_shape(shape, placeholder, replacement)
+    def replace_many(self, mapping):
+        """Replace every placeholder in mapping ({placeholder: replacement}) in one pass."""
+        pattern = compile_placeholders(mapping)
+        if pattern is None:
+            return
+        replace_in_paragraph_elements(self._text_paragraphs(), pattern, mapping)
+
+    def replace(self, placeholder, replacement):
+        self.replace_many({placeholder: replacement})
+
+def replace_placeholders_in_presentation(input_path, output_path, mapping):
+    """
+    Replace every placeholder in mapping ({placeholder: replacement}) throughout the
+    presentation in one pass over its parts.
+    """
+    with PptxEditor(input_path, output_path) as editor:
+        editor.replace_many(mapping)
 
-    prs.save(output_path)
-    print(f"Saved replaced PPTX -> {output_path}")
+def replace_placeholder_in_presentation(input_path, output_path, placeholder, replacement):
+    replace_placeholders_in_presentation(input_path, output_path, {placeholder: replacement})
 
 import os
 from pdf2image import convert_from_path, convert_from_bytes
 
+# Formats poppler can write itself; for any other fmt, pdf2image quietly has it write PPM
+_POPPLER_FORMATS = {"png", "jpeg", "jpg", "tif", "tiff"}
+
 def pdf_to_images(pdf_path, output_folder, fmt='PNG', dpi=200, poppler_path=None):
     """
     Convert each page of pdf_path into an image in output_folder.
@@ -129,11 +230,24 @@ def pdf_to_images(pdf_path, output_folder, fmt='PNG', dpi=200, poppler_path=None
 
     os.makedirs(output_folder, exist_ok=True)
 
-    if poppler_path:
-        pages = convert_from_path(pdf_path, dpi=dpi, fmt=fmt, poppler_path=poppler_path)
-    else:
-        pages = convert_from_path(pdf_path, dpi=dpi, fmt=fmt)
+    # pdf2image splits the page range over this many poppler processes
+    thread_count = os.cpu_count() or 1
+    options = {"poppler_path": poppler_path} if poppler_path else {}
+
+    if fmt.lower() in _POPPLER_FORMATS:
+        # poppler writes the image files itself and only their paths come back,
+        # instead of decoding every page into PIL and re-encoding it here
+        page_paths = convert_from_path(pdf_path, dpi=dpi, fmt=fmt, thread_count=thread_count,
+                                       output_folder=output_folder, paths_only=True, **options)
+        # Paths come back in page order; give them the usual page_N names
+        for i, path in enumerate(page_paths, start=1):
+            fname = os.path.join(output_folder, f"page_{i}.{ fmt.lower() }")
+            os.replace(path, fname)
+            print(f"Saved {fname}")
+        return
 
+    # Any other format (BMP, GIF, WEBP, ...) is encoded by PIL
+    pages = convert_from_path(pdf_path, dpi=dpi, fmt=fmt, thread_count=thread_count, **options)
     for i, page in enumerate(pages, start=1):
         fname = os.path.join(output_folder, f"page_{i}.{ fmt.lower() }")
         page.save(fname, fmt)
@@ -0,0 +1,49 @@
+import unittest
+
+from pptx import Presentation
+from pptx.util import Inches
+
+from pptx2img import compile_placeholders, replace_in_paragraph, replace_in_paragraph_elements, replace_in_shape
+
+def make_paragraph(run_texts):
+    prs = Presentation()
+    slide = prs.slides.add_slide(prs.slide_layouts[6])
+    paragraph = slide.shapes.add_textbox(0, 0, Inches(1), Inches(1)).text_frame.paragraphs[0]
+    for text in run_texts:
+        paragraph.add_run().text = text
+    return paragraph
+
+def replaced_text(run_texts, mapping):
+    paragraph = make_paragraph(run_texts)
+    replace_in_paragraph_elements([paragraph._p], compile_placeholders(mapping), mapping)
+    return ''.join(r.text for r in paragraph.runs)
+
+class ReplaceInParagraphElementsTest(unittest.TestCase):
+    def test_prefix_key_spanning_runs(self):
+        # "{{NAME}}" alone fits in the first run, but the longer key it prefixes spans both
+        mapping = {"{{NAME}}": "Bob", "{{NAME}}_FULL}}": "Bob Smith"}
+        self.assertEqual(replaced_text(["Dear {{NAME}}", "_FULL}} hi"], mapping), "Dear Bob Smith hi")
+
+    def test_self_overlapping_key(self):
+        self.assertEqual(replaced_text(["a", "aa"], {"aa": "X"}), "Xa")
+
+    def test_matches_inside_runs(self):
+        mapping = {"{{A}}": "1", "{{B}}": "22"}
+        self.assertEqual(replaced_text(["x{{A}}y{{B}}", "z{{A}}"], mapping), "x1y22z1")
+
+class PlaceholderSignatureTest(unittest.TestCase):
+    def test_replace_in_paragraph(self):
+        paragraph = make_paragraph(["Hello {{NA", "ME}}!"])
+        replace_in_paragraph(paragraph, "{{NAME}}", "Bob")
+        self.assertEqual(''.join(r.text for r in paragraph.runs), "Hello Bob!")
+
+    def test_replace_in_shape(self):
+        prs = Presentation()
+        slide = prs.slides.add_slide(prs.slide_layouts[6])
+        shape = slide.shapes.add_textbox(0, 0, Inches(1), Inches(1))
+        shape.text_frame.text = "Dear {{NAME}}"
+        replace_in_shape(shape, "{{NAME}}", "Bob")
+        self.assertEqual(shape.text_frame.text, "Dear Bob")
+
+if __name__ == "__main__":
+    unittest.main()